@@ -21,8 +21,9 @@ from diverse_seq.distance import (
     BottomSketch,
     euclidean_distance,
     euclidean_distances,
-    mash_distance,
     mash_distances,
+    mash_row_distances,
+    sketches_to_matrix,
 )
 from diverse_seq.io import (
     SeqArray,
@@ -261,6 +262,7 @@ class DvsParCtreeMixin:
                 self._sketch_size,
                 self._num_states,
                 mash_canonical=self._mash_canonical,
+                max_workers=self._numprocs,
                 progress=self._progress,
             )
 
@@ -391,7 +393,7 @@ class DvsParCtreeMixin:
             msg="Generating Sketches",
         ):
             idx = futures_to_idx[future]
-            bottom_sketches[idx] = future.result()
+            bottom_sketches[idx] = numpy.array(future.result(), dtype=numpy.int64)
 
         return bottom_sketches
 
@@ -637,10 +639,15 @@ def compute_mash_chunk_distances(
         The start index, and the calculated pairwise distances.
     """
     distances_chunk = dok_matrix((len(sketches), len(sketches)))
+    sketch_matrix, lengths = sketches_to_matrix(sketches)
     for i in range(start_idx, len(sketches), stride):
-        for j in range(i):
-            distance = mash_distance(sketches[i], sketches[j], k, sketch_size)
-            distances_chunk[i, j] = distance
+        distances_chunk[i, :i] = mash_row_distances(
+            sketch_matrix,
+            lengths,
+            i,
+            k,
+            sketch_size,
+        )
     return start_idx, distances_chunk
 
 
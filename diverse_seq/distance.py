@@ -1,5 +1,7 @@
+import itertools
 import math
-from collections.abc import Sequence
+from collections.abc import Iterator, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from typing import Literal, TypeAlias
 
 import cogent3.app.typing as c3_types
@@ -15,7 +17,14 @@ from diverse_seq.util import (
     populate_inmem_zstore,
 )
 
-BottomSketch: TypeAlias = list[int]
+BottomSketch: TypeAlias = np.ndarray
+
+# exceeds any 32-bit kmer hash, used to pad sketches
+_SKETCH_PAD = 2**32
+# offset added per sketch so the flattened sketch matrix is sorted
+_SKETCH_ROW_OFFSET = 2**33
+# upper bound on the number of elements compared in a batch
+_MASH_BATCH_SIZE = 2**20
 
 
 @define_app
@@ -123,6 +132,7 @@ def mash_distances(
     num_states: int,
     *,
     mash_canonical: bool = False,
+    max_workers: int = 1,
     progress: Progress | None = None,
 ) -> np.ndarray:
     """Calculates pairwise mash distances between sequences.
@@ -140,6 +150,8 @@ def mash_distances(
     mash_canonical
         whether to use mash canonical representation of kmers,
         by default False
+    max_workers
+        number of threads used to compute sketches, by default 1
     progress
         progress bar, by default None
 
@@ -157,20 +169,23 @@ def mash_distances(
         sketch_size,
         num_states,
         mash_canonical=mash_canonical,
+        max_workers=max_workers,
         progress=progress,
     )
 
-    num_pairs = len(sketches) * (len(sketches) - 1) // 2
-    pairs = ((i, j) for i in range(1, len(sketches)) for j in range(i))
-
     seqids = [sarr.seqid for sarr in seq_arrays]
     distances = np.zeros((len(sketches), len(sketches)))
+    sketch_matrix, lengths = sketches_to_matrix(sketches)
 
     dist_pbar = progress.child()
-    for i, j in dist_pbar(pairs, total=num_pairs, msg="Computing Pairwise Distances"):
-        distance = mash_distance(sketches[i], sketches[j], k, sketch_size)
-        distances[i, j] = distance
-        distances[j, i] = distance
+    for i in dist_pbar(
+        range(1, len(sketches)),
+        total=len(sketches) - 1,
+        msg="Computing Pairwise Distances",
+    ):
+        row = mash_row_distances(sketch_matrix, lengths, i, k, sketch_size)
+        distances[i, :i] = row
+        distances[:i, i] = row
 
     return DistanceMatrix.from_array_names(matrix=distances, names=seqids)
 
@@ -182,6 +197,7 @@ def mash_sketches(
     num_states: int,
     *,
     mash_canonical: bool = False,
+    max_workers: int = 1,
     progress: Progress | None = None,
 ) -> list[BottomSketch]:
     """Create sketch representations for a collection of sequence sequence arrays.
@@ -198,6 +214,8 @@ def mash_sketches(
         number of states.
     mash_canonical
         whether to use mash canonical kmer representation, by default False
+    max_workers
+        number of threads used to compute sketches, by default 1
     progress
         progress bar, by default None
 
@@ -209,20 +227,47 @@ def mash_sketches(
     if progress is None:
         progress = scinexus.get_progress(show_progress=False)
 
-    sketch_pbar = progress.child()
-    bottom_sketches = []
-    for seq_array in sketch_pbar(
-        seq_arrays, total=len(seq_arrays), msg="Generating Sketches"
-    ):
-        bottom_sketches.append(
-            dvs.mash_sketch(
+    bottom_sketches = [None for _ in range(len(seq_arrays))]
+
+    # mash_sketch releases the GIL, so sketches are computed in threads
+    # sequences are only loaded when submitted, so bounding the number
+    # in flight bounds how many are held in memory at once
+    max_pending = 2 * max_workers
+    indexed_arrays = enumerate(seq_arrays)
+
+    def submit(
+        executor: ThreadPoolExecutor,
+        pending: dict[Future, int],
+        num: int,
+    ) -> None:
+        for i, seq_array in itertools.islice(indexed_arrays, num):
+            future = executor.submit(
+                dvs.mash_sketch,
                 seq_array.get_seq(),
                 k,
                 int(sketch_size),
                 num_states,
                 mash_canonical,
             )
-        )
+            pending[future] = i
+
+    def completed(executor: ThreadPoolExecutor) -> Iterator[tuple[int, list[int]]]:
+        pending: dict[Future, int] = {}
+        submit(executor, pending, max_pending)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+            submit(executor, pending, len(done))
+
+    sketch_pbar = progress.child()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for idx, sketch in sketch_pbar(
+            completed(executor),
+            total=len(seq_arrays),
+            msg="Generating Sketches",
+        ):
+            bottom_sketches[idx] = np.array(sketch, dtype=np.int64)
 
     return bottom_sketches
 
@@ -251,34 +296,12 @@ def mash_distance(
     float
         The mash distance between two sketches.
     """
-    # Following the source code implementation
-    intersection_size = 0
-    union_size = 0
-
-    left_index = 0
-    right_index = 0
-    while (
-        union_size < sketch_size
-        and left_index < len(left_sketch)
-        and right_index < len(right_sketch)
-    ):
-        left, right = left_sketch[left_index], right_sketch[right_index]
-        if left < right:
-            left_index += 1
-        elif right < left:
-            right_index += 1
-        else:
-            left_index += 1
-            right_index += 1
-            intersection_size += 1
-        union_size += 1
-
-    if union_size < sketch_size:
-        if left_index < len(left_sketch):
-            union_size += len(left_sketch) - left_index
-        if right_index < len(right_sketch):
-            union_size += len(right_sketch) - right_index
-        union_size = min(union_size, sketch_size)
+    # Following the source code implementation, the union is the
+    # first sketch_size hashes of the merged sketches
+    merged = np.union1d(left_sketch, right_sketch)[: int(sketch_size)]
+    union_size = len(merged)
+    shared = np.intersect1d(left_sketch, right_sketch, assume_unique=True)
+    intersection_size = int(np.count_nonzero(shared <= merged[-1])) if union_size else 0
 
     jaccard = intersection_size / union_size
     if intersection_size == union_size:
@@ -291,6 +314,101 @@ def mash_distance(
     return distance
 
 
+def sketches_to_matrix(
+    sketches: Sequence[BottomSketch],
+) -> tuple[np.ndarray, np.ndarray]:
+    """Pack sketches into a padded int64 matrix for mash_row_distances.
+
+    Parameters
+    ----------
+    sketches
+        Sorted bottom sketches.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The sketch matrix and the length of each sketch.
+
+    Notes
+    -----
+    Each row is padded with a value exceeding any hash and offset by
+    its row index, so the flattened matrix is sorted.
+    """
+    lengths = np.array([len(sketch) for sketch in sketches], dtype=np.int64)
+    width = max(int(lengths.max(initial=0)), 1)
+    matrix = np.full((len(sketches), width), _SKETCH_PAD, dtype=np.int64)
+    for i, sketch in enumerate(sketches):
+        matrix[i, : len(sketch)] = sketch
+    matrix += np.arange(len(sketches), dtype=np.int64)[:, None] * _SKETCH_ROW_OFFSET
+    return matrix, lengths
+
+
+def mash_row_distances(
+    sketch_matrix: np.ndarray,
+    lengths: np.ndarray,
+    index: int,
+    k: int,
+    sketch_size: int,
+) -> np.ndarray:
+    """Compute the mash distances between a sketch and all preceding sketches.
+
+    Parameters
+    ----------
+    sketch_matrix
+        Sketches packed by sketches_to_matrix.
+    lengths
+        Length of each sketch.
+    index
+        Row of the sketch to compare against rows 0..index-1.
+    k
+        kmer size.
+    sketch_size
+        Size of the sketches.
+
+    Returns
+    -------
+    np.ndarray
+        The distance to each preceding sketch, identical to mash_distance.
+
+    Notes
+    -----
+    As in mash_distance, the union is the first sketch_size hashes of
+    the merged sketches and the intersection the shared hashes within
+    it. The rank of each hash within the merge is found for all rows
+    at once with a single searchsorted.
+    """
+    width = sketch_matrix.shape[1]
+    row = sketch_matrix[index] - index * _SKETCH_ROW_OFFSET
+    row_valid = np.arange(width) < lengths[index]
+    intersection = np.empty(index, dtype=np.int64)
+    num_shared = np.empty(index, dtype=np.int64)
+    batch = max(_MASH_BATCH_SIZE // width, 1)
+    for start in range(0, index, batch):
+        end = min(start + batch, index)
+        # row end is included as a sentinel exceeding every query
+        flattened = sketch_matrix[start : end + 1].ravel()
+        row_offsets = np.arange(start, end, dtype=np.int64)[:, None]
+        queries = row + row_offsets * _SKETCH_ROW_OFFSET
+        positions = np.searchsorted(flattened, queries)
+        shared = (flattened[positions] == queries) & row_valid
+        # number of hashes from the other sketch less than each query
+        num_less = positions - (row_offsets - start) * width
+        shared_before = np.cumsum(shared, axis=1) - shared
+        rank = np.arange(width) + num_less - shared_before
+        intersection[start:end] = (shared & (rank < sketch_size)).sum(axis=1)
+        num_shared[start:end] = shared.sum(axis=1)
+
+    union = np.minimum(lengths[index] + lengths[:index] - num_shared, sketch_size)
+    # only pairs sharing hashes are divided and logged, the rest have distance 1
+    sharing = intersection > 0
+    jaccard = np.divide(intersection, union, out=np.zeros(index), where=sharing)
+    log_ratio = np.zeros(index)
+    np.log(2 * jaccard / (1.0 + jaccard), out=log_ratio, where=sharing)
+    distances = np.where(sharing, np.minimum(-log_ratio / k, 1.0), 1.0)
+    distances[intersection == union] = 0.0
+    return distances
+
+
 def euclidean_distances(
     seq_arrays: Sequence[dvs.LazySeq],
     k: int,
@@ -315,22 +433,54 @@ def euclidean_distances(
     if progress is None:
         progress = scinexus.get_progress(show_progress=False)
 
-    distances = np.zeros((len(seq_arrays), len(seq_arrays)))
-
-    num_pairs = len(seq_arrays) * (len(seq_arrays) - 1) // 2
-    pairs = ((i, j) for i in range(1, len(seq_arrays)) for j in range(i))
-
     seqids = [sarr.seqid for sarr in seq_arrays]
     dist_pbar = progress.child()
-    for i, j in dist_pbar(pairs, total=num_pairs, msg="Computing Pairwise Distances"):
-        freq_i = np.array(seq_arrays[i].get_kfreqs(k))
-        freq_j = np.array(seq_arrays[j].get_kfreqs(k))
-        distance = euclidean_distance(freq_i, freq_j)
-        distances[i, j] = distance
-        distances[j, i] = distance
+    num_states = len(_get_canonical_states(moltype))
+    # filled row by row, so only one record's kfreqs is held at a time
+    freqs = np.empty((len(seq_arrays), num_states**k), dtype=np.float32)
+    for i, sarr in enumerate(
+        dist_pbar(
+            seq_arrays,
+            total=len(seq_arrays),
+            msg="Computing kmer Frequencies",
+        ),
+    ):
+        freqs[i] = sarr.get_kfreqs(k)
+    distances = euclidean_distance_matrix(freqs)
 
     return DistanceMatrix.from_array_names(matrix=distances, names=seqids)
 
 
+def euclidean_distance_matrix(freqs: np.ndarray) -> np.ndarray:
+    """Compute pairwise euclidean distances between the rows of freqs.
+
+    Parameters
+    ----------
+    freqs
+        Array of kmer frequencies, one row per sequence. Its columns are
+        centred in place.
+
+    Returns
+    -------
+    np.ndarray
+        Symmetric matrix of pairwise distances.
+
+    Notes
+    -----
+    Uses the expansion |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, so all
+    pairs come from a single matrix product computed in the dtype of
+    freqs. Columns are centred first, which leaves distances unchanged
+    but reduces cancellation when freqs is float32.
+    """
+    freqs -= freqs.mean(axis=0, dtype=np.float64).astype(freqs.dtype)
+    sum_sq = np.einsum("ij,ij->i", freqs, freqs)
+    sq_dists = sum_sq[:, None] + sum_sq[None, :] - 2 * (freqs @ freqs.T)
+    # rounding can leave small negative values for near-identical rows
+    distances = np.sqrt(np.maximum(sq_dists, 0.0)).astype(np.float64)
+    distances = (distances + distances.T) / 2
+    np.fill_diagonal(distances, 0.0)
+    return distances
+
+
 def euclidean_distance(freq_1: np.ndarray, freq_2: np.ndarray) -> np.ndarray:
     return np.linalg.norm(freq_1 - freq_2)
@@ -15,7 +15,6 @@ identify the set of sequences that maximise delta-JSD
 SummedRecords is the container that simplifies these applications
 """
 
-import itertools
 import pathlib
 import sys
 import typing
@@ -61,12 +60,9 @@ def select_final_max(
     max_size
         the maximum size of the set
     """
-    if len(summed) > 1:
-        num_records = len(
-            list(itertools.chain.from_iterable(sr.records for sr in summed))
-        )
-    else:
-        num_records = len(summed[0].records)
+    # size avoids converting every record's kfreqs to Python objects,
+    # which accessing records does
+    num_records = sum(sr.size for sr in summed)
 
     max_size = max_size or num_records
     return dvs.final_max(
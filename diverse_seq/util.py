@@ -29,6 +29,21 @@ if typing.TYPE_CHECKING:
     from click.core import Context, Option
 
 
+# value of characters not in an alphabet in a _get_str2arr_table table
+_INVALID_CHAR = 255
+
+
+@functools.cache
+def _get_str2arr_table(moltype: str) -> bytes:
+    """translation table from characters to their index in the most
+    degenerate alphabet of moltype, others map to _INVALID_CHAR"""
+    alphabet = get_moltype(moltype).most_degen_alphabet()
+    table = bytearray([_INVALID_CHAR] * 256)
+    for index, char in enumerate(alphabet):
+        table[ord(char)] = index
+    return bytes(table)
+
+
 @composable.define_app
 class str2arr:
     """convert string to array of uint8"""
@@ -37,11 +52,19 @@ class str2arr:
         self.max_length = max_length
         mt = get_moltype(moltype)
         self.alphabet = mt.most_degen_alphabet()
+        self._table = _get_str2arr_table(moltype)
 
     def main(self, data: str) -> numpy.ndarray:
         if self.max_length:
             data = data[: self.max_length]
 
+        if data.isascii():
+            # a single C-level pass, the bytearray makes the result writeable
+            indices = bytearray(data, "ascii").translate(self._table)
+            if _INVALID_CHAR not in indices:
+                return numpy.frombuffer(indices, dtype=numpy.uint8)
+
+        # the alphabet reports invalid characters
         return self.alphabet.to_indices(data)
 
 
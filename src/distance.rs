@@ -1,5 +1,5 @@
-use pyo3::prelude::{PyResult, pyfunction};
-use std::collections::{BinaryHeap, HashSet};
+use pyo3::prelude::{PyResult, Python, pyfunction};
+use std::collections::HashSet;
 
 /// Take the reverse complement of a kmer.
 ///
@@ -19,13 +19,19 @@ pub fn reverse_complement(kmer: &[u8]) -> Vec<u8> {
 }
 
 pub fn murmurhash3_32(data: &[u8], seed: u32) -> u32 {
+    murmurhash3_32_iter(data.iter().copied(), seed)
+}
+
+/// murmurhash3_32 of bytes produced by an iterator, e.g. a reverse
+/// complement that need not be collected first.
+pub fn murmurhash3_32_iter(data: impl ExactSizeIterator<Item = u8>, seed: u32) -> u32 {
     const DEFAULT_SEED: u32 = 0x9747B28C;
 
     let seed = if seed == 0 { DEFAULT_SEED } else { seed };
     let length = data.len() as u32;
     let mut h = seed ^ length;
 
-    for &value in data.iter() {
+    for value in data {
         let mut k = value as u32;
 
         // Mix the hash
@@ -63,74 +69,172 @@ pub fn murmurhash3_32(data: &[u8], seed: u32) -> u32 {
 ///
 /// Uses MurmurHash3 32-bit implementation.
 pub fn hash_kmer(kmer: &[u8], mash_canonical: bool) -> u32 {
-    let smallest = if mash_canonical {
-        let reverse = reverse_complement(kmer);
-
-        // Compare kmer with its reverse complement
-        for i in 0..kmer.len() {
-            if kmer[i] < reverse[i] {
-                break; // kmer is smaller, use original
-            }
-            if kmer[i] > reverse[i] {
-                // reverse is smaller, use it
-                return murmurhash3_32(&reverse, 0);
-            }
+    if mash_canonical {
+        // the reverse complement is compared and hashed lazily,
+        // avoiding an allocation per kmer
+        let reverse = kmer.iter().rev().map(|&base| (base + 2) % 4);
+        if reverse.clone().lt(kmer.iter().copied()) {
+            return murmurhash3_32_iter(reverse, 0);
         }
+    }
 
-        // If we get here, they're equal or kmer is smaller
-        kmer
-    } else {
-        kmer
-    };
-
-    murmurhash3_32(smallest, 0)
+    murmurhash3_32(kmer, 0)
 }
 
-/// Get the kmer hashes comprising a sequence.
+/// Iterate over the valid kmers of a sequence.
 ///
 /// # Arguments
 ///
 /// * `seq` - A sequence of uint8
 /// * `k` - kmer size.
 /// * `num_states` - Number of states allowed for sequence type.
-/// * `mash_canonical` - Whether to use the mash canonical representation of kmers.
 ///
 /// # Returns
 ///
-/// kmer hashes for the sequence.
-pub fn get_kmer_hashes(seq: &[u8], k: usize, num_states: u8, mash_canonical: bool) -> Vec<u32> {
-    if seq.len() < k {
-        return Vec::new();
-    }
-
-    let mut kmer_hashes = Vec::with_capacity(seq.len() - k + 1);
-
+/// kmers that contain no state >= num_states, in sequence order.
+pub fn valid_kmers(seq: &[u8], k: usize, num_states: u8) -> impl Iterator<Item = &[u8]> {
     // Find initial skip position
     let mut skip_until = 0;
-    for i in 0..k {
+    for i in 0..k.min(seq.len()) {
         if seq[i] >= num_states {
             skip_until = i + 1;
         }
     }
 
-    // Process each kmer using windows
-    for (i, kmer) in seq.windows(k).enumerate() {
+    seq.windows(k).enumerate().filter_map(move |(i, kmer)| {
         // Check if last position of current kmer is invalid
         if kmer[k - 1] >= num_states {
             skip_until = i + k;
         }
-
         // Skip invalid kmers
-        if i < skip_until {
+        if i < skip_until { None } else { Some(kmer) }
+    })
+}
+
+/// Get the kmer hashes comprising a sequence.
+///
+/// # Arguments
+///
+/// * `seq` - A sequence of uint8
+/// * `k` - kmer size.
+/// * `num_states` - Number of states allowed for sequence type.
+/// * `mash_canonical` - Whether to use the mash canonical representation of kmers.
+///
+/// # Returns
+///
+/// kmer hashes for the sequence.
+pub fn get_kmer_hashes(seq: &[u8], k: usize, num_states: u8, mash_canonical: bool) -> Vec<u32> {
+    valid_kmers(seq, k, num_states)
+        .map(|kmer| hash_kmer(kmer, mash_canonical))
+        .collect()
+}
+
+/// MurmurHash3 64-bit finalizer, folded to 32 bits.
+pub fn fmix64(mut h: u64) -> u32 {
+    h ^= h >> 33;
+    h = h.wrapping_mul(0xFF51AFD7ED558CCD);
+    h ^= h >> 33;
+    h = h.wrapping_mul(0xC4CEB9FE1A85EC53);
+    h ^= h >> 33;
+    (h ^ (h >> 32)) as u32
+}
+
+/// Hash a kmer packed into a u64.
+pub fn hash_packed_kmer(packed: u64) -> u32 {
+    const SEED: u64 = 0x9747B28C;
+    // seeded so the all-zero kmer does not hash to zero
+    fmix64(packed ^ SEED)
+}
+
+/// Number of bits required to pack a single state.
+fn bits_per_state(num_states: u8) -> u32 {
+    (u8::BITS - num_states.saturating_sub(1).leading_zeros()).max(1)
+}
+
+/// Whether kmers can be packed into a u64 by rolling_kmer_hashes.
+fn can_pack_kmers(k: usize, num_states: u8, mash_canonical: bool) -> bool {
+    // the packed reverse complement assumes cogent3 DNA/RNA
+    let states_ok = !mash_canonical || num_states == 4;
+    k > 0 && states_ok && bits_per_state(num_states) as usize * k <= 64
+}
+
+/// Add the hashes of the valid kmers of a sequence to hashes.
+///
+/// Each kmer is packed into a u64, first state most significant,
+/// that is updated with a single shift per position. The packed
+/// reverse complement is maintained alongside for mash canonical
+/// kmers. Packed values order the same as the kmers, so the canonical
+/// kmer is the smaller of the two.
+///
+/// # Notes
+///
+/// Requires can_pack_kmers(k, num_states, mash_canonical).
+fn rolling_kmer_hashes(
+    seq: &[u8],
+    k: usize,
+    num_states: u8,
+    mash_canonical: bool,
+    hashes: &mut HashSet<u32>,
+) {
+    let bits = bits_per_state(num_states);
+    let width = bits as usize * k;
+    let mask = if width == 64 {
+        u64::MAX
+    } else {
+        (1u64 << width) - 1
+    };
+    let rev_shift = width as u32 - bits;
+    let mut fwd: u64 = 0;
+    let mut rev: u64 = 0;
+    let mut filled: usize = 0;
+    for &state in seq {
+        if state >= num_states {
+            filled = 0;
             continue;
         }
+        fwd = ((fwd << bits) | state as u64) & mask;
+        if mash_canonical {
+            // complement is offset by 2, see reverse_complement
+            rev = (rev >> bits) | (((state ^ 2) as u64) << rev_shift);
+        }
+        filled += 1;
+        if filled >= k {
+            let packed = if mash_canonical { fwd.min(rev) } else { fwd };
+            hashes.insert(hash_packed_kmer(packed));
+        }
+    }
+}
 
-        // Hash valid kmer
-        let hash = hash_kmer(kmer, mash_canonical);
-        kmer_hashes.push(hash);
+/// The unique kmer hashes of a sequence.
+pub fn unique_kmer_hashes(
+    seq: &[u8],
+    k: usize,
+    num_states: u8,
+    mash_canonical: bool,
+) -> HashSet<u32> {
+    let mut hashes = HashSet::new();
+    if can_pack_kmers(k, num_states, mash_canonical) {
+        rolling_kmer_hashes(seq, k, num_states, mash_canonical, &mut hashes);
+    } else {
+        hashes.extend(valid_kmers(seq, k, num_states).map(|kmer| hash_kmer(kmer, mash_canonical)));
     }
+    hashes
+}
 
-    kmer_hashes
+/// The sketch_size smallest hashes, sorted.
+///
+/// Uses selection rather than a heap, so is linear in the number of
+/// hashes on average.
+pub fn bottom_sketch(mut hashes: Vec<u32>, sketch_size: usize) -> Vec<u32> {
+    if sketch_size == 0 {
+        return Vec::new();
+    }
+    if hashes.len() > sketch_size {
+        hashes.select_nth_unstable(sketch_size - 1);
+        hashes.truncate(sketch_size);
+    }
+    hashes.sort_unstable();
+    hashes
 }
 
 #[pyfunction]
@@ -149,36 +253,20 @@ pub fn get_kmer_hashes(seq: &[u8], k: usize, num_states: u8, mash_canonical: boo
 ///
 /// The bottom sketch for the given sequence array.
 pub fn mash_sketch(
+    py: Python<'_>,
     seq_array: &[u8],
     k: usize,
     sketch_size: usize,
     num_states: u8,
     mash_canonical: bool,
 ) -> PyResult<Vec<u32>> {
-    // Get unique kmer hashes
-    let kmer_hashes = get_kmer_hashes(seq_array, k, num_states, mash_canonical);
-    let unique_hashes: HashSet<u32> = kmer_hashes.into_iter().collect();
-
-    // Use a max-heap to keep the smallest sketch_size elements
-    // BinaryHeap is a max-heap by default, so we store values directly
-    let mut heap = BinaryHeap::new();
-
-    for kmer_hash in unique_hashes {
-        if heap.len() < sketch_size {
-            heap.push(kmer_hash);
-        } else if let Some(&max) = heap.peek() {
-            if kmer_hash < max {
-                heap.pop();
-                heap.push(kmer_hash);
-            }
-        }
-    }
-
-    // Convert heap to sorted vector
-    let mut result: Vec<u32> = heap.into_iter().collect();
-    result.sort_unstable();
-
-    Ok(result)
+    // no Python objects are touched, so the GIL is released allowing
+    // sketches to be computed from multiple threads
+    Ok(py.detach(|| {
+        // Get unique kmer hashes
+        let unique_hashes = unique_kmer_hashes(seq_array, k, num_states, mash_canonical);
+        bottom_sketch(unique_hashes.into_iter().collect(), sketch_size)
+    }))
 }
 
 #[cfg(test)]
@@ -189,4 +277,88 @@ mod tests {
         let rev_comp = super::reverse_complement(&kmer);
         assert_eq!(rev_comp, vec![1, 0, 3, 2]);
     }
+
+    #[test]
+    fn test_hash_kmer_canonical() {
+        let kmer = vec![2, 0, 1, 3, 3];
+        let rev_comp = super::reverse_complement(&kmer);
+        let expect = super::murmurhash3_32(&rev_comp.clone().min(kmer.clone()), 0);
+        assert_eq!(super::hash_kmer(&kmer, true), expect);
+        assert_eq!(super::hash_kmer(&rev_comp, true), expect);
+        assert_eq!(
+            super::hash_kmer(&kmer, false),
+            super::murmurhash3_32(&kmer, 0)
+        );
+        // palindromic kmer
+        let kmer = vec![0, 2];
+        assert_eq!(
+            super::hash_kmer(&kmer, true),
+            super::murmurhash3_32(&kmer, 0)
+        );
+    }
+
+    #[test]
+    fn test_bottom_sketch() {
+        let hashes = vec![9, 3, 7, 1, 8, 2, 6];
+        assert_eq!(super::bottom_sketch(hashes.clone(), 3), vec![1, 2, 3]);
+        assert_eq!(
+            super::bottom_sketch(hashes.clone(), 7),
+            vec![1, 2, 3, 6, 7, 8, 9]
+        );
+        assert_eq!(super::bottom_sketch(hashes.clone(), 20).len(), 7);
+        assert!(super::bottom_sketch(hashes, 0).is_empty());
+    }
+
+    #[test]
+    fn test_valid_kmers() {
+        // positions 2 and 6 are invalid for num_states=4
+        let seq = vec![0, 1, 4, 2, 3, 0, 5, 1];
+        let kmers: Vec<&[u8]> = super::valid_kmers(&seq, 2, 4).collect();
+        assert_eq!(kmers, vec![&[0, 1][..], &[2, 3][..], &[3, 0][..]]);
+        // shorter than k gives nothing
+        assert_eq!(super::valid_kmers(&seq[..1], 2, 4).count(), 0);
+        let hashes = super::get_kmer_hashes(&seq, 2, 4, false);
+        assert_eq!(hashes.len(), 3);
+    }
+
+    fn pack(kmer: &[u8]) -> u64 {
+        kmer.iter()
+            .fold(0, |packed, &state| (packed << 2) | state as u64)
+    }
+
+    #[test]
+    fn test_rolling_kmer_hashes() {
+        let seq = vec![0, 1, 4, 2, 3, 0, 5, 1, 3, 3, 2];
+        let got = super::unique_kmer_hashes(&seq, 3, 4, false);
+        let expect: std::collections::HashSet<u32> = super::valid_kmers(&seq, 3, 4)
+            .map(|kmer| super::hash_packed_kmer(pack(kmer)))
+            .collect();
+        assert_eq!(got, expect);
+        assert_eq!(got.len(), 3);
+    }
+
+    #[test]
+    fn test_rolling_kmer_hashes_canonical() {
+        let seq = vec![0, 0, 1, 2, 3, 3, 1, 0, 2];
+        let rc = super::reverse_complement(&seq);
+        let fwd = super::unique_kmer_hashes(&seq, 4, 4, true);
+        assert_eq!(fwd, super::unique_kmer_hashes(&rc, 4, 4, true));
+        let expect: std::collections::HashSet<u32> = seq
+            .windows(4)
+            .map(|kmer| {
+                let packed = pack(kmer).min(pack(&super::reverse_complement(kmer)));
+                super::hash_packed_kmer(packed)
+            })
+            .collect();
+        assert_eq!(fwd, expect);
+    }
+
+    #[test]
+    fn test_unique_kmer_hashes_unpackable() {
+        // k too large to pack, uses the byte hash
+        let seq: Vec<u8> = (0..40).map(|i| (i % 4) as u8).collect();
+        let got = super::unique_kmer_hashes(&seq, 33, 4, false);
+        assert_eq!(got.len(), 4);
+        assert!(got.contains(&super::hash_kmer(&seq[..33], false)));
+    }
 }
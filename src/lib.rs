@@ -166,8 +166,10 @@ fn get_delta_jsd_calculator(
     k: usize,
     num_states: usize,
 ) -> PyResult<SummedRecordsWrapper> {
-    let result = SummedRecordsWrapper::new(seqids_seqs, k, num_states);
-    Ok(result)
+    run_with_panic_to_pyerr(
+        || SummedRecordsWrapper::new(seqids_seqs, k, num_states),
+        "get_delta_jsd_calculator panicked (likely: invalid kmer frequencies)",
+    )
 }
 
 /// A Python module implemented in Rust.
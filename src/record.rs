@@ -6,24 +6,14 @@ use crate::zarr_io::ZarrStore;
 use crate::zarr_py::ZarrStoreWrapper;
 use std::cell::Cell;
 
-/// Coefficients for multi-dimensional coordinate conversion into 1D index.
-fn coord_conversion_coeffs(num_states: usize, k: usize) -> Vec<usize> {
-    (1..=k)
-        .rev()
-        .map(|i| num_states.pow((i - 1) as u32))
-        .collect()
-}
-
-// converts k-mer into single integer
-fn kmer_to_index(kmer: &[u8], num_states: usize, coeffs: &[usize], max_index: usize) -> usize {
+// converts k-mer into single integer, using Horner's rule
+fn kmer_to_index(kmer: &[u8], num_states: usize, max_index: usize) -> usize {
     let mut index: usize = 0;
-    for (i, &byte) in kmer.iter().enumerate() {
+    for &byte in kmer {
         if byte as usize >= num_states {
-            index = max_index;
-            break;
-        } else {
-            index += coeffs[i] * (byte as usize);
+            return max_index;
         }
+        index = index * num_states + byte as usize;
     }
     index
 }
@@ -39,66 +29,115 @@ fn count_monomers(seq: &[u8], num_states: usize) -> Vec<usize> {
 }
 
 fn count_kmers(seq: &[u8], num_states: usize, k: usize) -> Vec<usize> {
-    let coeffs = coord_conversion_coeffs(num_states, k);
+    if num_states.is_power_of_two() {
+        return count_kmers_shifted(seq, num_states, k);
+    }
     let size: usize = num_states.pow(k as u32);
     let mut counts = vec![0usize; size];
-    let mut skip_until = 0;
-
-    for (i, state) in seq.iter().take(k).enumerate() {
-        if (*state as usize) >= num_states {
-            skip_until = i + 1
-        }
-    }
-
-    let mut index: isize = -1;
     let nstates = num_states as u8;
-    let biggest_coeff = coeffs[0] as isize;
-
-    for (i, window) in seq.windows(k).enumerate() {
-        let gained_char = seq[i + k - 1];
-        if gained_char >= nstates {
-            // we reset the kmer index to invalid
-            // until we get a proper one
-            index = -1;
-            skip_until = i + k;
+    // coefficient of the leading state of a window
+    let biggest_coeff = num_states.pow(k as u32 - 1);
+
+    // index of the previous window, if it was valid
+    let mut index: Option<usize> = None;
+    // number of states to pass before a window ending at the current
+    // state contains no invalid states
+    let mut pending: usize = k - 1;
+    for (i, &state) in seq.iter().enumerate() {
+        if state >= nstates {
+            index = None;
+            pending = k;
         }
-        if i < skip_until {
+        if pending > 0 {
+            pending -= 1;
             continue;
         }
 
-        if index < 0 {
-            index = kmer_to_index(window, num_states, &coeffs, size - 1) as isize;
-        } else {
-            let dropped_char = seq[i - 1] as isize;
-            index =
-                (index - dropped_char * biggest_coeff) * num_states as isize + gained_char as isize;
-        }
+        let current = match index {
+            // roll the previous window along one state
+            Some(previous) => {
+                (previous - seq[i - k] as usize * biggest_coeff) * num_states + state as usize
+            }
+            None => kmer_to_index(&seq[i + 1 - k..=i], num_states, size - 1),
+        };
+        counts[current] += 1;
+        index = Some(current);
+    }
+    counts
+}
+
+/// count_kmers for num_states a power of two (e.g. DNA), where rolling
+/// the index is a shift and a mask rather than a multiply
+fn count_kmers_shifted(seq: &[u8], num_states: usize, k: usize) -> Vec<usize> {
+    let bits = num_states.trailing_zeros();
+    let size: usize = 1 << (bits * k as u32);
+    let mask = size - 1;
+    let mut counts = vec![0usize; size];
+    let nstates = num_states as u8;
 
-        if index < 0 {
+    // bits of states from before an invalid state are shifted out before
+    // pending reaches 0
+    let mut index: usize = 0;
+    let mut pending: usize = k - 1;
+    for &state in seq {
+        if state >= nstates {
+            pending = k - 1;
             continue;
-        } else {
-            counts[index as usize] += 1;
         }
+        index = ((index << bits) | state as usize) & mask;
+        if pending > 0 {
+            pending -= 1;
+            continue;
+        }
+        counts[index] += 1;
     }
     counts
 }
 
+/// divides counts by total, reusing the allocation of counts
+fn counts_to_freqs(kcounts: Vec<usize>, total: f64) -> Vec<f64> {
+    kcounts
+        .into_iter()
+        .map(|count| count as f64 / total)
+        .collect()
+}
+
 pub fn entropy(kfreqs: &Vec<f64>) -> f64 {
-    if kfreqs.is_empty() {
+    entropy_from_iter(kfreqs.iter().copied())
+}
+
+/// entropy of frequencies produced by an iterator
+///
+/// Allows callers to compute derived frequencies (e.g. means) on the fly,
+/// in the same pass as the entropy, without allocating a vector.
+pub fn entropy_from_iter(kfreqs: impl ExactSizeIterator<Item = f64>) -> f64 {
+    let num_freqs = kfreqs.len();
+    checked_entropy(kfreqs, num_freqs)
+}
+
+/// entropy of the nonzero elements of kfreqs, visiting only those
+pub fn entropy_of_nonzero(kfreqs: &[f64], nonzero: &[u32]) -> f64 {
+    checked_entropy(nonzero.iter().map(|&i| kfreqs[i as usize]), kfreqs.len())
+}
+
+/// entropy of the frequencies, which must sum to 1 within a tolerance
+/// scaled by num_freqs, the length of the full frequency vector
+fn checked_entropy(kfreqs: impl Iterator<Item = f64>, num_freqs: usize) -> f64 {
+    if num_freqs == 0 {
         panic!("cannot calculate entropy as frequency vector empty");
     }
     let mut entropy: f64 = 0.0;
     let mut total_freq: f64 = 0.0;
-    for freq in kfreqs.iter() {
-        if *freq == 0.0 {
+    for freq in kfreqs {
+        if freq == 0.0 {
             continue;
         }
-        entropy += -*freq * freq.log2();
-        total_freq += *freq;
+        entropy += -freq * freq.log2();
+        total_freq += freq;
     }
     // Use tolerance accounting for accumulated rounding errors
     // Rule of thumb: n * epsilon where n is number of operations
-    let tolerance = (kfreqs.len() as f64) * f64::EPSILON;
+    let tolerance = (num_freqs as f64) * f64::EPSILON;
     if (total_freq - 1.0).abs() > tolerance {
         panic!("cannot calculate entropy as frequency vector total {total_freq}!=1.0");
     }
@@ -136,15 +175,17 @@ impl<'a> SeqRecord<'a> {
         if total == 0.0 {
             return Err(format!("No valid k-mers for '{}'", self.seqid).into());
         }
-        let kfreqs: Vec<f64> = kcounts.iter().map(|x| *x as f64 / total).collect();
+        let kfreqs = counts_to_freqs(kcounts, total);
         Ok(KmerSeq::new(self.seqid, kfreqs, self.num_states, k))
     }
 }
 
-#[derive(Debug, Clone)]
+#[derive(Debug)]
 pub struct KmerSeq {
     pub seqid: String,    // yes
     pub kfreqs: Vec<f64>, // yes
+    // indices of the nonzero kfreqs, ascending
+    pub nonzero: Vec<u32>,
     pub entropy: f64,
     // a Cell because they are mutable, even when
     // their container is not
@@ -153,13 +194,45 @@ pub struct KmerSeq {
     pub k: usize,             // yes
 }
 
+impl Clone for KmerSeq {
+    fn clone(&self) -> Self {
+        Self {
+            seqid: self.seqid.clone(),
+            kfreqs: self.kfreqs.clone(),
+            nonzero: self.nonzero.clone(),
+            entropy: self.entropy,
+            delta_jsd: self.delta_jsd.clone(),
+            num_states: self.num_states,
+            k: self.k,
+        }
+    }
+
+    /// reuses the existing seqid and kfreqs allocations
+    fn clone_from(&mut self, source: &Self) {
+        self.seqid.clone_from(&source.seqid);
+        self.kfreqs.clone_from(&source.kfreqs);
+        self.nonzero.clone_from(&source.nonzero);
+        self.entropy = source.entropy;
+        self.delta_jsd.set(source.delta_jsd.get());
+        self.num_states = source.num_states;
+        self.k = source.k;
+    }
+}
+
 impl KmerSeq {
     pub fn new(seqid: &str, kfreqs: Vec<f64>, num_states: usize, k: usize) -> Self {
         let delta_jsd: Cell<f64> = Cell::new(0.0);
-        let entropy: f64 = entropy(&kfreqs);
+        let nonzero: Vec<u32> = kfreqs
+            .iter()
+            .enumerate()
+            .filter(|(_, freq)| **freq != 0.0)
+            .map(|(i, _)| u32::try_from(i).expect("kmer index exceeds u32::MAX"))
+            .collect();
+        let entropy: f64 = entropy_of_nonzero(&kfreqs, &nonzero);
         Self {
             seqid: seqid.to_string(),
             kfreqs,
+            nonzero,
             entropy,
             delta_jsd,
             num_states,
@@ -171,6 +244,7 @@ impl KmerSeq {
         Self {
             seqid: self.seqid.to_string(),
             kfreqs: self.kfreqs.clone(),
+            nonzero: self.nonzero.clone(),
             entropy: self.entropy,
             delta_jsd: 0.0.into(),
             num_states: self.num_states,
@@ -256,7 +330,7 @@ impl LazySeq {
     pub fn get_kfreqs(&self, k: usize) -> PyResult<Vec<f64>> {
         let kcounts = self.get_kcounts(k)?;
         let total = kcounts.iter().sum::<usize>() as f64;
-        let kfreqs = kcounts.iter().map(|x| *x as f64 / total).collect();
+        let kfreqs = counts_to_freqs(kcounts, total);
         Ok(kfreqs)
     }
 
@@ -281,6 +355,20 @@ mod tests {
         assert_eq!(entropy, 2.0);
     }
 
+    #[test]
+    fn entropy_from_iter_matches_entropy() {
+        let counts = [3.0, 0.0, 2.0, 5.0];
+        let freqs: Vec<f64> = counts.iter().map(|c| c / 10.0).collect();
+        let got = entropy_from_iter(counts.iter().map(|c| c / 10.0));
+        assert_eq!(got, entropy(&freqs));
+    }
+
+    #[test]
+    fn entropy_of_nonzero_matches_entropy() {
+        let freqs = vec![0.0, 0.25, 0.0, 0.125, 0.5, 0.0, 0.125, 0.0];
+        assert_eq!(entropy_of_nonzero(&freqs, &[1, 3, 4, 6]), entropy(&freqs));
+    }
+
     #[rstest]
     #[case(vec![0.0, 0.0, 0.0, 0.0])]
     #[case(vec![])]
@@ -298,11 +386,16 @@ mod tests {
     #[case([4, 3], 16)]
     #[case([4, 4], 16)]
     fn kmer_to_index_valid(#[case] seq: [u8; 2], #[case] expected: usize) {
-        let coeffs = coord_conversion_coeffs(4, 2);
-        let index = kmer_to_index(&seq, 4, &coeffs, 16);
+        let index = kmer_to_index(&seq, 4, 16);
         assert_eq!(index, expected);
     }
 
+    #[test]
+    fn counts_to_freqs_values() {
+        let freqs = counts_to_freqs(vec![1, 0, 3, 4], 8.0);
+        assert_eq!(freqs, vec![0.125, 0.0, 0.375, 0.5]);
+    }
+
     #[test]
     fn kmer_count() {
         let seq: [u8; 21] = [
@@ -313,6 +406,39 @@ mod tests {
         assert_eq!(kcounts, expect);
     }
 
+    #[rstest]
+    #[case(4, 2)]
+    #[case(4, 3)]
+    #[case(4, 5)]
+    #[case(2, 3)]
+    #[case(3, 2)]
+    #[case(3, 4)]
+    #[case(5, 3)]
+    fn kmer_count_matches_windows(#[case] num_states: usize, #[case] k: usize) {
+        let seq: [u8; 24] = [
+            5, 2, 1, 0, 3, 3, 5, 1, 0, 2, 2, 3, 1, 5, 5, 0, 1, 2, 3, 0, 0, 1, 5, 2,
+        ];
+        let size = num_states.pow(k as u32);
+        let mut expect = vec![0usize; size];
+        for window in seq
+            .windows(k)
+            .filter(|w| w.iter().all(|&s| (s as usize) < num_states))
+        {
+            let index: usize = window
+                .iter()
+                .enumerate()
+                .map(|(i, &s)| s as usize * num_states.pow((k - 1 - i) as u32))
+                .sum();
+            expect[index] += 1;
+        }
+        assert_eq!(count_kmers(&seq, num_states, k), expect);
+        // shorter than k
+        assert_eq!(
+            count_kmers(&seq[..k - 1], num_states, k),
+            vec![0usize; size]
+        );
+    }
+
     #[test]
     fn seq_record_to_kmerseq_invalidk() {
         let seqid = String::from("blah");
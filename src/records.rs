@@ -3,9 +3,9 @@ use crate::zarr_io::ZarrStore;
 use core::panic;
 use std::collections::HashSet;
 
-use crate::record::{KmerSeq, LazySeqRecord, SeqRecord, entropy};
+use crate::record::{KmerSeq, LazySeqRecord, SeqRecord, entropy_from_iter};
 
-#[derive(Debug, Clone)]
+#[derive(Debug)]
 /// Container of most divergent sequences
 pub struct SummedRecords {
     pub records: Vec<KmerSeq>,
@@ -16,6 +16,14 @@ pub struct SummedRecords {
     summed_entropies. */
     pub summed_kfreqs: Vec<f64>,
     pub summed_entropies: f64,
+    /* summed_kfreqs minus the lowest record's kfreqs, and the sum of
+    its entropy terms once divided by size. Allows increases_jsd to
+    only visit the kmers present in a candidate. */
+    pub without_lowest: Vec<f64>,
+    pub without_lowest_entropy: f64,
+    // delta_jsd of each record, in the same order as records, and their sum
+    pub delta_jsds: Vec<f64>,
+    pub delta_jsd_sum: f64,
     // total_jsd is from all records
     pub total_jsd: f64,
     // The record with the minimum delta_JSD.
@@ -23,6 +31,40 @@ pub struct SummedRecords {
     pub seqids: HashSet<String>,
 }
 
+impl Clone for SummedRecords {
+    fn clone(&self) -> Self {
+        Self {
+            records: self.records.clone(),
+            size: self.size,
+            summed_kfreqs: self.summed_kfreqs.clone(),
+            summed_entropies: self.summed_entropies,
+            without_lowest: self.without_lowest.clone(),
+            without_lowest_entropy: self.without_lowest_entropy,
+            delta_jsds: self.delta_jsds.clone(),
+            delta_jsd_sum: self.delta_jsd_sum,
+            total_jsd: self.total_jsd,
+            lowest_index: self.lowest_index,
+            seqids: self.seqids.clone(),
+        }
+    }
+
+    /// reuses the existing buffers, so a scratch copy can be
+    /// refreshed without allocating
+    fn clone_from(&mut self, source: &Self) {
+        self.records.clone_from(&source.records);
+        self.size = source.size;
+        self.summed_kfreqs.clone_from(&source.summed_kfreqs);
+        self.summed_entropies = source.summed_entropies;
+        self.without_lowest.clone_from(&source.without_lowest);
+        self.without_lowest_entropy = source.without_lowest_entropy;
+        self.delta_jsds.clone_from(&source.delta_jsds);
+        self.delta_jsd_sum = source.delta_jsd_sum;
+        self.total_jsd = source.total_jsd;
+        self.lowest_index = source.lowest_index;
+        self.seqids.clone_from(&source.seqids);
+    }
+}
+
 impl SummedRecords {
     pub fn new(records: Vec<KmerSeq>) -> Self {
         if records.is_empty() {
@@ -41,45 +83,90 @@ impl SummedRecords {
             summed_entropies += record.entropy;
         }
         // calculate total jsd
-        let mean_kfreqs = div_vector(&summed_kfreqs, size as f64);
-        let total_jsd: f64 = entropy(&mean_kfreqs) - summed_entropies / size as f64;
+        let total_jsd: f64 =
+            entropy_of_mean(&summed_kfreqs, size as f64) - summed_entropies / size as f64;
         /* compute delta_jsd for each KmerSeq
         panic if there's a nan, displaying KmerSeq.seqid
         record the index of the KmerSeq with the lowest delta_jsd
         at the end subtract lowest from all for the summed_kcounts
         and summed_entropies  */
         let seqids: HashSet<String> = records.iter().map(|r| r.seqid.to_string()).collect();
+        let mut delta_jsds: Vec<f64> = Vec::with_capacity(records.len());
         let lowest_index: u32 = get_lowest_record_index(
             &records,
-            num_kmers,
             &summed_kfreqs,
             summed_entropies,
             total_jsd,
+            &mut delta_jsds,
         );
-        Self {
+        let delta_jsd_sum: f64 = delta_jsds.iter().sum();
+        let mut summed = Self {
             records,
             size,
             summed_kfreqs,
             summed_entropies,
+            without_lowest: Vec::with_capacity(num_kmers),
+            without_lowest_entropy: 0.0,
+            delta_jsds,
+            delta_jsd_sum,
             total_jsd,
             lowest_index,
             seqids,
-        }
+        };
+        summed.cache_without_lowest();
+        summed
+    }
+
+    /// caches summed_kfreqs excluding the lowest record and its entropy terms
+    fn cache_without_lowest(&mut self) {
+        let size = self.size as f64;
+        let lowest_kfreqs = &self.records[self.lowest_index as usize].kfreqs;
+        self.without_lowest.clear();
+        self.without_lowest.extend(
+            self.summed_kfreqs
+                .iter()
+                .zip(lowest_kfreqs)
+                .map(|(summed, lowest)| clamped(summed - lowest)),
+        );
+        self.without_lowest_entropy = self
+            .without_lowest
+            .iter()
+            .map(|freq| entropy_term(freq / size))
+            .sum();
     }
 
     pub fn delta_jsd(&self, rec: &KmerSeq) -> f64 {
         if self.seqids.contains(&rec.seqid) {
             return 0.0;
         }
-        let lowest_rec = &self.records[self.lowest_index as usize];
-        let mut mean_kfreqs = vec![0f64; lowest_rec.kfreqs.len()];
+        let lowest = self.lowest_index as usize;
+        let size = self.size as f64;
         let mean_entropy =
-            (self.summed_entropies - lowest_rec.entropy + rec.entropy) / self.size as f64;
-        for i in 0..mean_kfreqs.len() {
-            mean_kfreqs[i] =
-                (self.summed_kfreqs[i] - lowest_rec.kfreqs[i] + rec.kfreqs[i]) / self.size as f64;
+            (self.summed_entropies - self.records[lowest].entropy + rec.entropy) / size;
+        // mean kfreqs are computed within the entropy pass, avoiding an allocation
+        let entropy_of_mean = entropy_from_iter(
+            self.summed_kfreqs
+                .iter()
+                .zip(&self.records[lowest].kfreqs)
+                .zip(&rec.kfreqs)
+                .map(|((summed, lowest), freq)| (clamped(summed - lowest) + freq) / size),
+        );
+        entropy_of_mean - mean_entropy
+    }
+
+    /// delta_jsd from the cached entropy terms of the records
+    /// excluding the lowest, only updating terms for kmers present in rec
+    fn incremental_delta_jsd(&self, rec: &KmerSeq) -> f64 {
+        let size = self.size as f64;
+        let lowest = self.lowest_index as usize;
+        let mean_entropy =
+            (self.summed_entropies - self.records[lowest].entropy + rec.entropy) / size;
+        let mut entropy_of_mean = self.without_lowest_entropy;
+        for &i in &rec.nonzero {
+            let base = self.without_lowest[i as usize];
+            let freq = rec.kfreqs[i as usize];
+            entropy_of_mean += entropy_term((base + freq) / size) - entropy_term(base / size);
         }
-        let entropy_of_mean = entropy(&mean_kfreqs);
         entropy_of_mean - mean_entropy
     }
 
@@ -87,23 +174,30 @@ impl SummedRecords {
         if self.seqids.contains(&rec.seqid) {
             return false;
         }
-        let jsd = self.delta_jsd(rec);
+        let jsd = self.incremental_delta_jsd(rec);
+        debug_assert!(
+            (jsd - self.delta_jsd(rec)).abs() < 1e-9,
+            "incremental delta_jsd diverged from dense calculation"
+        );
         jsd > self.total_jsd + f64::EPSILON
     }
 
     pub fn drop_lowest(&mut self) {
-        let old_rec = self.records.remove(self.lowest_index as usize);
+        let lowest = self.lowest_index as usize;
+        let old_rec = self.records.remove(lowest);
         // remove from hashset
         self.seqids.remove(&old_rec.seqid);
 
         // remove lowest from total entropies
-        let num_kmers: usize = old_rec.kfreqs.len();
         self.summed_entropies -= old_rec.entropy;
-        // and remove from summed_kfreqs
-        for i in 0..num_kmers {
-            self.summed_kfreqs[i] -= old_rec.kfreqs[i];
-            if self.summed_kfreqs[i] <= f64::EPSILON {
-                self.summed_kfreqs[i] = 0.0;
+        self.delta_jsds.remove(lowest);
+        self.delta_jsd_sum = self.delta_jsds.iter().sum();
+        // and remove from summed_kfreqs, only kmers present in old_rec change
+        for &i in &old_rec.nonzero {
+            let summed = &mut self.summed_kfreqs[i as usize];
+            *summed -= old_rec.kfreqs[i as usize];
+            if *summed <= f64::EPSILON {
+                *summed = 0.0;
             }
         }
     }
@@ -121,29 +215,29 @@ impl SummedRecords {
         if self.seqids.contains(&rec.seqid) {
             return;
         }
-        let num_kmers: usize = self.records[0].kfreqs.len();
         let seqid = rec.seqid.to_string();
         self.seqids.insert(seqid);
 
         // add to total entropies
         self.summed_entropies += rec.entropy;
-        // and summed_kfreqs
-        for i in 0..num_kmers {
-            self.summed_kfreqs[i] += &rec.kfreqs[i];
+        // and summed_kfreqs, in place for kmers present in rec
+        for &i in &rec.nonzero {
+            self.summed_kfreqs[i as usize] += rec.kfreqs[i as usize];
         }
         self.records.push(rec);
         self.size = self.records.len() as u32;
-        let mean_kfreqs = div_vector(&self.summed_kfreqs, self.size as f64);
-        let mean_entropy = entropy(&mean_kfreqs);
+        let mean_entropy = entropy_of_mean(&self.summed_kfreqs, self.size as f64);
         self.total_jsd = mean_entropy - self.summed_entropies / self.size as f64;
         let lowest_index: u32 = get_lowest_record_index(
             &self.records,
-            num_kmers,
             &self.summed_kfreqs,
             self.summed_entropies,
             self.total_jsd,
+            &mut self.delta_jsds,
         );
         self.lowest_index = lowest_index;
+        self.delta_jsd_sum = self.delta_jsds.iter().sum();
+        self.cache_without_lowest();
     }
 
     pub fn get_by_seqid(&self, seqid: &str) -> Option<&KmerSeq> {
@@ -154,14 +248,14 @@ impl SummedRecords {
         self.total_jsd / self.size as f64
     }
     pub fn mean_delta_jsd(&self) -> f64 {
-        self.records.iter().map(|r| r.delta_jsd.get()).sum::<f64>() / self.size as f64
+        self.delta_jsd_sum / self.size as f64
     }
 
     pub fn std_delta_jsd(&self) -> f64 {
         let mean = self.mean_delta_jsd();
         let mut sum = 0.0;
-        for r in &self.records {
-            sum += (r.delta_jsd.get() - mean).powi(2);
+        for delta_jsd in &self.delta_jsds {
+            sum += (delta_jsd - mean).powi(2);
         }
         // unbiased estimator
         (sum / (self.size as f64 - 1.0)).sqrt()
@@ -179,15 +273,6 @@ impl SummedRecords {
             .collect::<Vec<(String, Vec<f64>, f64)>>()
     }
 
-    pub fn clone(&self) -> Self {
-        let records = self
-            .records
-            .iter()
-            .map(|r| r.clone())
-            .collect::<Vec<KmerSeq>>();
-        Self::new(records)
-    }
-
     pub fn for_display(&self, title: String) -> String {
         let record_deltas = self
             .get_raw_kseqs()
@@ -219,38 +304,72 @@ impl SummedRecords {
 /// update delta_jsd on records and return index for lowest delta_jsd
 fn get_lowest_record_index(
     records: &[KmerSeq],
-    num_kmers: usize,
     summed_kfreqs: &[f64],
     summed_entropies: f64,
     total_jsd: f64,
+    delta_jsds: &mut Vec<f64>,
 ) -> u32 {
     let div = records.len() as f64 - 1.0;
     if div <= 0.0 {
         panic!("must have > 1 KmerSeq");
     }
-    let mut min_delta_jsd: f64 = 1e6;
-    let mut lowest_index: u32 = 0;
-    let mut mean_kfreqs = vec![0f64; num_kmers];
-    for (i, record) in records.iter().enumerate() {
-        // calculating the mean entropy of records but this one
+    // the JSD contribution from each record is the total JSD minus
+    // the JSD of all records but that one. Removing a record only changes
+    // the mean kfreqs at its nonzero kmers, so the entropy of the mean
+    // without it is the full-mean entropy with just those terms replaced
+    let full_mean_terms: Vec<f64> = summed_kfreqs
+        .iter()
+        .map(|summed| entropy_term(clamped(summed / div)))
+        .collect();
+    let full_mean_entropy: f64 = full_mean_terms.iter().sum();
+    delta_jsds.clear();
+    delta_jsds.extend(records.iter().map(|record| {
         let mean_entropy = (summed_entropies - record.entropy) / div;
+        let mut entropy_of_mean = full_mean_entropy;
+        for &i in &record.nonzero {
+            let i = i as usize;
+            let without = clamped((summed_kfreqs[i] - record.kfreqs[i]) / div);
+            entropy_of_mean += entropy_term(without) - full_mean_terms[i];
+        }
+        total_jsd - (entropy_of_mean - mean_entropy)
+    }));
+    // a single check over the batch, reporting all affected records
+    if delta_jsds.iter().any(|delta_jsd| delta_jsd.is_nan()) {
+        let seqids: Vec<&str> = records
+            .iter()
+            .zip(delta_jsds.iter())
+            .filter(|(_, delta_jsd)| delta_jsd.is_nan())
+            .map(|(record, _)| record.seqid.as_str())
+            .collect();
+        panic!("delta_jsd is NaN for records {seqids:?}");
+    }
 
-        // calculate the mean kfreqs of records but this one
-        updated_mean_freqs(&mut mean_kfreqs, summed_kfreqs, &record.kfreqs, div);
-        let entropy_of_mean = entropy(&mean_kfreqs);
-
-        // JSD for all records but this one
-        let jsd = entropy_of_mean - mean_entropy;
-        // the JSD contribution from the current record
-        record.delta_jsd.set(total_jsd - jsd);
-        if record.delta_jsd.get() < min_delta_jsd {
-            min_delta_jsd = record.delta_jsd.get();
+    let mut min_delta_jsd: f64 = 1e6;
+    let mut lowest_index: u32 = 0;
+    for (i, (record, &delta_jsd)) in records.iter().zip(delta_jsds.iter()).enumerate() {
+        record.delta_jsd.set(delta_jsd);
+        if delta_jsd < min_delta_jsd {
+            min_delta_jsd = delta_jsd;
             lowest_index = i as u32;
         }
     }
     lowest_index
 }
 
+/// rounding residue from subtracting frequencies is set to zero
+fn clamped(freq: f64) -> f64 {
+    if freq <= f64::EPSILON { 0.0 } else { freq }
+}
+
+/// the contribution of a single frequency to entropy
+fn entropy_term(freq: f64) -> f64 {
+    if freq == 0.0 {
+        0.0
+    } else {
+        -freq * freq.log2()
+    }
+}
+
 /// add two f64 vectors, updating first in place
 fn iadd_vectors(summed_freqs: &mut [f64], freqs: &[f64]) {
     assert_eq!(
@@ -263,26 +382,13 @@ fn iadd_vectors(summed_freqs: &mut [f64], freqs: &[f64]) {
     }
 }
 
-/// return vector<f64> divided by a scalar
-fn div_vector(vector: &[f64], div: f64) -> Vec<f64> {
+/// entropy of summed_kfreqs divided by a scalar, without allocating the mean
+fn entropy_of_mean(summed_kfreqs: &[f64], div: f64) -> f64 {
     if div == 0.0 {
         panic!("division by zero");
     }
 
-    vector.iter().map(|x| *x / div).collect()
-}
-
-/// update vector
-fn updated_mean_freqs(dest: &mut [f64], total_freqs: &[f64], record_kfreqs: &[f64], div: f64) {
-    if dest.len() != total_freqs.len() || dest.len() != record_kfreqs.len() {
-        panic!("length mismatch for mean_freqs")
-    };
-    for i in 0..dest.len() {
-        dest[i] = (total_freqs[i] - record_kfreqs[i]) / div;
-        if dest[i] <= f64::EPSILON {
-            dest[i] = 0.0;
-        }
-    }
+    entropy_from_iter(summed_kfreqs.iter().map(|x| *x / div))
 }
 
 fn get_lazyrecords_and_init_summed_records(
@@ -386,6 +492,37 @@ pub enum Stat {
     Std,
 }
 
+/// adds candidates to summed while they increase the statistic, replacing
+/// the lowest record once max_size is reached
+fn extend_max_divergent(
+    mut summed: SummedRecords,
+    candidates: impl Iterator<Item = KmerSeq>,
+    stat: Stat,
+    max_size: usize,
+) -> SummedRecords {
+    // scratch copy for trial pushes, refreshed in place with clone_from
+    let mut trial = summed.clone();
+    for rec in candidates {
+        if !summed.increases_jsd(&rec) {
+            continue;
+        } else if summed.size == max_size as u32 {
+            summed.replace_lowest(rec);
+            continue;
+        }
+
+        trial.clone_from(&summed);
+        trial.push(rec);
+        let improved = match stat {
+            Stat::Cov => trial.cov_delta_jsd() > summed.cov_delta_jsd(),
+            Stat::Std => trial.std_delta_jsd() > summed.std_delta_jsd(),
+        };
+        if improved {
+            std::mem::swap(&mut summed, &mut trial);
+        }
+    }
+    summed
+}
+
 /// returns SummedRecords of sequences that maximise divergence
 pub fn select_max_divergent(
     store: &ZarrStore,
@@ -414,43 +551,14 @@ pub fn select_max_divergent(
     } else {
         seqids.len()
     };
-    let (records, mut summed) =
+    let (records, summed) =
         get_lazyrecords_and_init_summed_records(store, seqids, min_size, k, num_states);
 
     // now iterate over the rest
-    for i in min_size..records.len() {
-        let rec = records[i].to_kmerseq(k);
-        if !rec.is_ok() {
-            continue;
-        }
-        let rec = rec.unwrap();
-        if !summed.increases_jsd(&rec) {
-            continue;
-        } else if summed.size == max_size as u32 {
-            summed.replace_lowest(rec);
-            continue;
-        }
-
-        let mut new_summed = summed.clone();
-        new_summed.push(rec);
-        summed = match stat {
-            Stat::Cov => {
-                if new_summed.cov_delta_jsd() > summed.cov_delta_jsd() {
-                    new_summed
-                } else {
-                    summed
-                }
-            }
-            Stat::Std => {
-                if new_summed.std_delta_jsd() > summed.std_delta_jsd() {
-                    new_summed
-                } else {
-                    summed
-                }
-            }
-        };
-    }
-    summed
+    let candidates = records[min_size..]
+        .iter()
+        .filter_map(|r| r.to_kmerseq(k).ok());
+    extend_max_divergent(summed, candidates, stat, max_size)
 }
 
 pub fn select_max_divergent_final<T: std::ops::Deref<Target = SummedRecordsResult>>(
@@ -473,37 +581,54 @@ pub fn select_max_divergent_final<T: std::ops::Deref<Target = SummedRecordsResul
     } else {
         num_records
     };
-    let (records, mut summed) = get_kmerseqs_and_init_summed_records(&records, min_size);
+    let (records, summed) = get_kmerseqs_and_init_summed_records(&records, min_size);
 
     // now iterate over the rest
-    for rec in records {
-        if !summed.increases_jsd(&rec) {
-            continue;
-        } else if summed.size == max_size as u32 {
-            summed.replace_lowest(rec);
-            continue;
-        }
+    extend_max_divergent(summed, records.into_iter(), stat, max_size)
+}
 
-        let mut new_summed = summed.clone();
-        new_summed.push(rec);
-        summed = match stat {
-            Stat::Cov => {
-                if new_summed.cov_delta_jsd() > summed.cov_delta_jsd() {
-                    new_summed
-                } else {
-                    summed
-                }
-            }
-            Stat::Std => {
-                if new_summed.std_delta_jsd() > summed.std_delta_jsd() {
-                    new_summed
-                } else {
-                    summed
-                }
-            }
-        };
-    }
-    summed
+/// smallest number of sequences worth handing to a separate thread
+const MIN_RECORDS_PER_THREAD: usize = 16;
+
+/// KmerSeq of each record that has kmers, in input order, with the
+/// counting split across up to num_threads threads
+fn records_to_kmerseqs(
+    records: &[(String, Vec<u8>)],
+    k: usize,
+    num_states: usize,
+    num_threads: usize,
+) -> Vec<KmerSeq> {
+    let to_kmerseqs = |chunk: &[(String, Vec<u8>)]| -> Vec<KmerSeq> {
+        chunk
+            .iter()
+            .filter_map(|(seqid, seq)| {
+                let seqrec = SeqRecord::new(seqid, seq, num_states);
+                seqrec.to_kmerseq(k).ok()
+            })
+            .collect()
+    };
+    let chunk_size = records
+        .len()
+        .div_ceil(num_threads.max(1))
+        .max(MIN_RECORDS_PER_THREAD);
+    if records.len() <= chunk_size {
+        return to_kmerseqs(records);
+    }
+
+    std::thread::scope(|scope| {
+        let handles: Vec<_> = records
+            .chunks(chunk_size)
+            .map(|chunk| scope.spawn(move || to_kmerseqs(chunk)))
+            .collect();
+        handles
+            .into_iter()
+            .flat_map(|handle| {
+                handle
+                    .join()
+                    .unwrap_or_else(|e| std::panic::resume_unwind(e))
+            })
+            .collect()
+    })
 }
 
 pub fn make_summed_records(
@@ -511,21 +636,13 @@ pub fn make_summed_records(
     k: usize,
     num_states: usize,
 ) -> SummedRecords {
-    let mut kseq_recs: Vec<KmerSeq> = Vec::new();
-
-    for (seqid, seq) in records.iter() {
-        let seqrec = SeqRecord::new(seqid, seq, num_states);
-        let kseq = seqrec.to_kmerseq(k);
-        if kseq.is_ok() {
-            kseq_recs.push(kseq.unwrap());
-        }
-    }
-    SummedRecords::new(kseq_recs)
+    let num_threads = std::thread::available_parallelism().map_or(1, |n| n.get());
+    SummedRecords::new(records_to_kmerseqs(&records, k, num_states, num_threads))
 }
 
 #[cfg(test)]
 mod tests {
-    use crate::record::SeqRecord;
+    use crate::record::{SeqRecord, entropy};
     use rstest::{fixture, rstest};
 
     use super::*;
@@ -556,32 +673,20 @@ mod tests {
     }
 
     #[test]
-    fn divide_vector() {
-        let v1 = vec![1.0, 2.0, 3.0];
-        let div: f64 = 2.0;
-        let expect = vec![1.0 / div, 2.0 / div, 3.0 / div];
+    fn mean_entropy() {
+        let v1 = vec![1.0, 2.0, 0.0, 1.0];
+        let div: f64 = 4.0;
+        let expect = entropy(&vec![1.0 / div, 2.0 / div, 0.0, 1.0 / div]);
 
-        let got: Vec<f64> = div_vector(&v1, div);
+        let got: f64 = entropy_of_mean(&v1, div);
         assert_eq!(got, expect);
     }
 
     #[test]
-    fn invalid_mean_freqs() {
-        let mut wrk = vec![0.0, 0.1, 0.2, 0.1];
-        let tots = vec![0.0, 0.1, 0.2, 0.1];
-        let rec = vec![0.0, 0.1, 0.2];
-
-        let result = catch_unwind(AssertUnwindSafe(|| {
-            updated_mean_freqs(&mut wrk, &tots, &rec, 4.0)
-        }));
-        assert!(result.is_err());
-    }
-
-    #[test]
-    fn div_vector_by_zero() {
+    fn mean_entropy_div_by_zero() {
         let v1 = vec![1.0, 2.0, 3.0];
         let div: f64 = 0.0;
-        let result = catch_unwind(|| div_vector(&v1, div));
+        let result = catch_unwind(|| entropy_of_mean(&v1, div));
         assert!(result.is_err());
     }
 
@@ -610,14 +715,14 @@ mod tests {
         assert_eq!(entropies, vec![2.0, 1.9219280948873623, 0.9182958340544896]);
         let delta_jsds: Vec<f64> = summed.records.iter().map(|r| r.delta_jsd.get()).collect();
         assert_eq!(summed.summed_entropies, 4.840223928941851);
-        assert_eq!(
-            delta_jsds,
-            vec![
-                -0.09602255461972087,
-                -0.013445832597674734,
-                0.2931216853661194
-            ]
-        );
+        let expect = [
+            -0.09602255461972087,
+            -0.013445832597674734,
+            0.2931216853661194,
+        ];
+        for (got, expect) in delta_jsds.iter().zip(expect) {
+            assert!((got - expect).abs() < 1e-12);
+        }
     }
     #[test]
     fn invalid_input_summed() {
@@ -626,12 +731,55 @@ mod tests {
         assert!(result.is_err());
     }
 
+    #[test]
+    #[should_panic(expected = "delta_jsd is NaN for records")]
+    fn invalid_nan_delta_jsd() {
+        let mut records: Vec<KmerSeq> = [
+            SeqRecord::new("seq1", &[0, 1, 2, 3], 4),
+            SeqRecord::new("seq2", &[1, 1, 3], 4),
+        ]
+        .iter()
+        .map(|sr| sr.to_kmerseq(1).unwrap())
+        .collect();
+        records.push(KmerSeq::new("seq3", vec![f64::NAN; 4], 4, 1));
+        SummedRecords::new(records);
+    }
+
     #[rstest]
     fn check_increases_jsd(summed: SummedRecords) {
         let better = SeqRecord::new("seq4", &[0, 1, 2, 1], 4);
         assert!(summed.increases_jsd(&better.to_kmerseq(1).unwrap()));
     }
 
+    #[rstest]
+    fn check_incremental_delta_jsd(mut summed: SummedRecords) {
+        let better = SeqRecord::new("seq4", &[0, 1, 2, 1], 4)
+            .to_kmerseq(1)
+            .unwrap();
+        let expect = summed.delta_jsd(&better);
+        assert!((summed.incremental_delta_jsd(&better) - expect).abs() < 1e-12);
+        // cache is refreshed when membership changes
+        summed.replace_lowest(better);
+        let other = SeqRecord::new("seq5", &[3, 3, 1, 0], 4)
+            .to_kmerseq(1)
+            .unwrap();
+        let expect = summed.delta_jsd(&other);
+        assert!((summed.incremental_delta_jsd(&other) - expect).abs() < 1e-12);
+    }
+
+    #[test]
+    fn check_nonzero_kmers() {
+        let rec = SeqRecord::new("seq1", &[0, 0, 3, 3, 0], 4)
+            .to_kmerseq(1)
+            .unwrap();
+        assert_eq!(rec.nonzero, vec![0, 3]);
+        let rec = SeqRecord::new("seq1", &[0, 0, 3, 3, 0], 4)
+            .to_kmerseq(2)
+            .unwrap();
+        // TT, TG, GG, GT
+        assert_eq!(rec.nonzero, vec![0, 3, 12, 15]);
+    }
+
     #[rstest]
     fn check_not_increases_jsd(summed: SummedRecords) {
         let same = &summed.records[0];
@@ -668,6 +816,15 @@ mod tests {
         assert!(summed.total_jsd != orig_jsd);
     }
 
+    #[rstest]
+    fn check_delta_jsds_synced(mut summed: SummedRecords) {
+        let better = SeqRecord::new("seq4", &[0, 1, 2, 1], 4);
+        summed.replace_lowest(better.to_kmerseq(1).unwrap());
+        let expect: Vec<f64> = summed.records.iter().map(|r| r.delta_jsd.get()).collect();
+        assert_eq!(summed.delta_jsds, expect);
+        assert_eq!(summed.delta_jsd_sum, expect.iter().sum::<f64>());
+    }
+
     #[rstest]
     fn check_mean_jsd(summed: SummedRecords) {
         assert_eq!(summed.mean_jsd(), summed.total_jsd / summed.size as f64);
@@ -676,12 +833,12 @@ mod tests {
     #[rstest]
     fn check_mean_delta_jsd(summed: SummedRecords) {
         // value from python version of diverse-seq
-        assert_eq!(summed.mean_delta_jsd(), 0.061217766049574594);
+        assert!((summed.mean_delta_jsd() - 0.061217766049574594).abs() < 1e-12);
     }
 
     #[rstest]
     fn check_std_delta_jsd(summed: SummedRecords) {
-        assert_eq!(summed.std_delta_jsd(), 0.20503487410866827);
+        assert!((summed.std_delta_jsd() - 0.20503487410866827).abs() < 1e-12);
     }
     #[rstest]
     fn check_cov_delta_jsd(summed: SummedRecords) {
@@ -821,6 +978,38 @@ mod tests {
         assert_eq!(orig.seqids, clone.seqids);
         assert_eq!(orig.summed_entropies, clone.summed_entropies);
         assert_eq!(orig.summed_kfreqs, clone.summed_kfreqs);
+        assert_eq!(orig.without_lowest, clone.without_lowest);
+    }
+
+    #[test]
+    fn checked_clone_from() {
+        let orig = summed234();
+        let mut scratch = orig.clone();
+        let rec = SeqRecord::new("seq5", &[0, 1, 2, 3], 4)
+            .to_kmerseq(1)
+            .unwrap();
+        scratch.push(rec);
+        scratch.clone_from(&orig);
+        assert_eq!(scratch.size, orig.size);
+        assert_eq!(scratch.seqids, orig.seqids);
+        assert_eq!(scratch.delta_jsds, orig.delta_jsds);
+        assert_eq!(scratch.without_lowest, orig.without_lowest);
+        assert_eq!(scratch.total_jsd, orig.total_jsd);
+        let seqids: Vec<&str> = scratch.records.iter().map(|r| r.seqid.as_str()).collect();
+        assert_eq!(seqids, vec!["seq3", "seq4", "seq2"]);
+    }
+
+    #[test]
+    fn checked_clone_independent() {
+        let orig = summed234();
+        let mut clone = orig.clone();
+        let rec = SeqRecord::new("seq5", &[0, 1, 2, 3], 4)
+            .to_kmerseq(1)
+            .unwrap();
+        clone.push(rec);
+        assert_eq!(clone.size, orig.size + 1);
+        assert_ne!(orig.summed_kfreqs, clone.summed_kfreqs);
+        assert_eq!(orig.records.len() + 1, clone.records.len());
     }
 
     #[test]
@@ -949,6 +1138,27 @@ mod tests {
         assert!(!rs.total_jsd.is_nan());
     }
 
+    #[test]
+    fn records_to_kmerseqs_keeps_order() {
+        // enough records to be split across threads, with some too
+        // short to have kmers
+        let records: Vec<(String, Vec<u8>)> = (0..100)
+            .map(|i| {
+                let len = if i % 7 == 0 { 2 } else { 10 + i % 13 };
+                let seq = (0..len).map(|j| ((i * j + j / 3) % 4) as u8).collect();
+                (format!("s{i}"), seq)
+            })
+            .collect();
+        let expect = records_to_kmerseqs(&records, 3, 4, 1);
+        let got = records_to_kmerseqs(&records, 3, 4, 4);
+        assert!(expect.len() < records.len());
+        assert_eq!(got.len(), expect.len());
+        for (g, e) in got.iter().zip(&expect) {
+            assert_eq!(g.seqid, e.seqid);
+            assert_eq!(g.kfreqs, e.kfreqs);
+        }
+    }
+
     #[test]
     fn check_summed_records_to_few() {
         let result = catch_unwind(AssertUnwindSafe(|| {
@@ -2,7 +2,35 @@ use crate::record::SeqRecord;
 use crate::records::{SummedRecords, make_summed_records};
 use pyo3::Python;
 use pyo3::prelude::{Bound, PyErr, PyResult, pyclass, pymethods};
-use pyo3::types::{PyAnyMethods, PyDict, PyDictMethods};
+use pyo3::types::{PyAnyMethods, PyBytes, PyDict, PyDictMethods};
+
+/// Nonzero kfreqs as little-endian u32 indices and f64 values.
+fn pack_kfreqs(kfreqs: &[f64]) -> (Vec<u8>, Vec<u8>) {
+    let mut indices = Vec::new();
+    let mut values = Vec::new();
+    for (i, &freq) in kfreqs.iter().enumerate() {
+        if freq != 0.0 {
+            let index = u32::try_from(i).expect("kmer index exceeds u32::MAX");
+            indices.extend_from_slice(&index.to_le_bytes());
+            values.extend_from_slice(&freq.to_le_bytes());
+        }
+    }
+    (indices, values)
+}
+
+/// Inverse of pack_kfreqs, size is the length of the dense kfreqs.
+fn unpack_kfreqs(indices: &[u8], values: &[u8], size: usize) -> PyResult<Vec<f64>> {
+    let invalid = || PyErr::new::<pyo3::exceptions::PyValueError, _>("Corrupt pickled kfreqs");
+    if indices.len() % 4 != 0 || values.len() != 2 * indices.len() {
+        return Err(invalid());
+    }
+    let mut kfreqs = vec![0.0; size];
+    for (index, value) in indices.chunks_exact(4).zip(values.chunks_exact(8)) {
+        let index = u32::from_le_bytes(index.try_into().unwrap()) as usize;
+        *kfreqs.get_mut(index).ok_or_else(invalid)? = f64::from_le_bytes(value.try_into().unwrap());
+    }
+    Ok(kfreqs)
+}
 
 #[pyclass(module = "diverse_seq._dvs")]
 #[derive(Clone)]
@@ -55,7 +83,24 @@ impl SummedRecordsResult {
         }
 
         set_field!("total_jsd", self.total_jsd);
-        set_field!("records", self.records.clone());
+        // kfreqs are mostly zero for larger k, so only the nonzero
+        // entries are pickled
+        let kfreqs_size = self.records.first().map_or(0, |r| r.1.len());
+        let records: Vec<_> = self
+            .records
+            .iter()
+            .map(|(name, kfreqs, delta_jsd)| {
+                let (indices, values) = pack_kfreqs(kfreqs);
+                (
+                    name.as_str(),
+                    PyBytes::new(py, &indices),
+                    PyBytes::new(py, &values),
+                    *delta_jsd,
+                )
+            })
+            .collect();
+        set_field!("kfreqs_size", kfreqs_size);
+        set_field!("sparse_records", records);
         set_field!("mean_delta_jsd", self.mean_delta_jsd);
         set_field!("std_delta_jsd", self.std_delta_jsd);
         set_field!("cov_delta_jsd", self.cov_delta_jsd);
@@ -76,7 +121,24 @@ impl SummedRecordsResult {
         }
 
         self.total_jsd = get_field!("total_jsd");
-        self.records = get_field!("records");
+        self.records = match state.get_item("sparse_records")? {
+            Some(records) => {
+                let kfreqs_size: usize = get_field!("kfreqs_size");
+                let records: Vec<(String, Vec<u8>, Vec<u8>, f64)> = records.extract()?;
+                records
+                    .into_iter()
+                    .map(|(name, indices, values, delta_jsd)| {
+                        Ok((
+                            name,
+                            unpack_kfreqs(&indices, &values, kfreqs_size)?,
+                            delta_jsd,
+                        ))
+                    })
+                    .collect::<PyResult<_>>()?
+            }
+            // pickled before records were stored sparsely
+            None => get_field!("records"),
+        };
         self.mean_delta_jsd = get_field!("mean_delta_jsd");
         self.std_delta_jsd = get_field!("std_delta_jsd");
         self.cov_delta_jsd = get_field!("cov_delta_jsd");
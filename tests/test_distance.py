@@ -1,8 +1,20 @@
 # pylint: disable=not-callable
+import threading
+
 import cogent3 as c3
 import numpy as np
+import pytest
 
-from diverse_seq.distance import dvs_dist
+from diverse_seq import distance as dvs_distance
+from diverse_seq.distance import (
+    dvs_dist,
+    euclidean_distance,
+    euclidean_distance_matrix,
+    mash_distance,
+    mash_row_distances,
+    mash_sketches,
+    sketches_to_matrix,
+)
 
 
 def calc_expected_euclidean(seqs, name_order, k):
@@ -27,6 +39,41 @@ def calc_expected_euclidean(seqs, name_order, k):
     return c3.evolve.fast_distance.DistanceMatrix.from_array_names(mat, name_order)
 
 
+def calc_expected_mash(left_sketch, right_sketch, k, sketch_size):
+    # merge of sorted sketches, following the mash source
+    intersection_size = 0
+    union_size = 0
+    left_index = 0
+    right_index = 0
+    while (
+        union_size < sketch_size
+        and left_index < len(left_sketch)
+        and right_index < len(right_sketch)
+    ):
+        left, right = left_sketch[left_index], right_sketch[right_index]
+        if left < right:
+            left_index += 1
+        elif right < left:
+            right_index += 1
+        else:
+            left_index += 1
+            right_index += 1
+            intersection_size += 1
+        union_size += 1
+
+    if union_size < sketch_size:
+        union_size += len(left_sketch) - left_index
+        union_size += len(right_sketch) - right_index
+        union_size = min(union_size, sketch_size)
+
+    if intersection_size == union_size:
+        return 0.0
+    if intersection_size == 0:
+        return 1.0
+    jaccard = intersection_size / union_size
+    return min(-np.log(2 * jaccard / (1.0 + jaccard)) / k, 1.0)
+
+
 def test_euclidean_distance(unaligned_seqs):
     k = 5
     app = dvs_dist(
@@ -62,6 +109,22 @@ def test_euclidean_distance(unaligned_seqs):
     assert np.allclose(dists.array, expect.array, atol=1e-3)
 
 
+def test_euclidean_distance_matrix():
+    rng = np.random.default_rng(7)
+    freqs = rng.random((6, 64))
+    freqs /= freqs.sum(axis=1, keepdims=True)
+    freqs[3] = freqs[1]
+    got = euclidean_distance_matrix(freqs.copy())
+    expect = np.array(
+        [[euclidean_distance(f1, f2) for f2 in freqs] for f1 in freqs],
+    )
+    assert np.allclose(got, expect)
+    assert np.allclose(got, got.T)
+    got32 = euclidean_distance_matrix(freqs.astype(np.float32))
+    assert got32.dtype == np.float64
+    assert np.allclose(got32, expect, atol=1e-6)
+
+
 def test_mash_distance(unaligned_seqs):
     app = dvs_dist(
         "mash",
@@ -136,3 +199,82 @@ def test_mash_distance(unaligned_seqs):
     assert (
         dists["Manatee", "Dugong"] < dists["Manatee", "Rhesus"]
     )  # dugong closer than rhesus
+
+
+@pytest.mark.parametrize("sketch_size", [5, 20, 4e9])
+def test_mash_row_distances(sketch_size):
+    rng = np.random.default_rng(13)
+    sketches = [
+        np.sort(rng.choice(60, size=size, replace=False))
+        for size in (20, 20, 7, 20, 1, 15)
+    ]
+    # disjoint and identical sketches
+    sketches.extend([np.arange(100, 120), sketches[0]])
+    matrix, lengths = sketches_to_matrix(sketches)
+    for i in range(len(sketches)):
+        got = mash_row_distances(matrix, lengths, i, 3, sketch_size)
+        expect = [
+            calc_expected_mash(sketches[i], sketches[j], 3, sketch_size)
+            for j in range(i)
+        ]
+        assert np.allclose(got, expect)
+        got = [
+            mash_distance(sketches[i], sketches[j], 3, sketch_size) for j in range(i)
+        ]
+        assert np.allclose(got, expect)
+
+
+class _LoadCounter:
+    """records how many sequences are loaded at once, across threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = 0
+        self.max = 0
+
+    def load(self):
+        with self._lock:
+            self.loaded += 1
+            self.max = max(self.max, self.loaded)
+
+    def release(self):
+        with self._lock:
+            self.loaded -= 1
+
+
+class _CountedSeq:
+    """stands in for a LazySeq, recording how many are loaded at once"""
+
+    def __init__(self, seq, counter):
+        self._seq = seq
+        self._counter = counter
+
+    def get_seq(self):
+        self._counter.load()
+        return self._seq
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_mash_sketches_bounded(monkeypatch, max_workers):
+    rng = np.random.default_rng(7)
+    counter = _LoadCounter()
+    seqs = [rng.integers(0, 4, size=200, dtype=np.uint8).tobytes() for _ in range(60)]
+    orig_sketch = dvs_distance.dvs.mash_sketch
+
+    def counted_sketch(seq, *args):
+        result = orig_sketch(seq, *args)
+        counter.release()
+        return result
+
+    monkeypatch.setattr(dvs_distance.dvs, "mash_sketch", counted_sketch)
+    got = mash_sketches(
+        [_CountedSeq(s, counter) for s in seqs],
+        8,
+        10,
+        4,
+        max_workers=max_workers,
+    )
+    # at most twice the number of workers are loaded at once
+    assert counter.max <= 2 * max_workers
+    expect = [orig_sketch(s, 8, 10, 4, mash_canonical=False) for s in seqs]
+    assert [g.tolist() for g in got] == expect
@@ -85,16 +85,17 @@ def test_most_divergent_n_to_big(zstore):
         dvs.nmost_divergent(zstore, n=30, k=k)
 
 
-def test_most_divergent_pickle(zstore):
+@pytest.mark.parametrize("k", [1, 4])
+def test_most_divergent_pickle(zstore, k):
     # can we pickle a nmost_divergent result and unpickle it
     import pickle  # noqa: PLC0415
 
-    k = 1
     orig = dvs.nmost_divergent(zstore, n=3, k=k)
     assert orig.size == 3
     dumped = pickle.dumps(orig)
     loaded = pickle.loads(dumped)  # noqa: S301
     assert loaded.size == orig.size
+    assert loaded.records == orig.records
 
 
 @pytest.fixture(scope="session")
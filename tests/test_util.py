@@ -2,6 +2,7 @@ import sys
 
 import pytest
 from cogent3 import get_moltype
+from scinexus.composable import NotCompleted
 
 from diverse_seq import util as dvs_util
 
@@ -17,6 +18,23 @@ def test_str2arr():
     assert g[-2] > 3  # index for non-canonical character > num_states
 
 
+@pytest.mark.parametrize("moltype", ("dna", "rna", "protein"))
+def test_str2arr_matches_alphabet(moltype):
+    alpha = get_moltype(moltype).most_degen_alphabet()
+    seq = "".join(alpha) * 3
+    app = dvs_util.str2arr(moltype=moltype)
+    got = app(seq)  # pylint: disable=not-callable
+    assert (got == alpha.to_indices(seq)).all()
+    assert got.dtype == alpha.to_indices(seq).dtype
+    assert got.flags.writeable
+
+
+def test_str2arr_invalid():
+    app = dvs_util.str2arr()
+    got = app("ACGjT")  # pylint: disable=not-callable
+    assert isinstance(got, NotCompleted)
+
+
 @pytest.mark.parametrize("seq", ("ACGTT", "ACGNT", "AYGTT", ""))
 def test_arr2str(seq):
     app = dvs_util.str2arr() + dvs_util.arr2str()